@@ -25,11 +25,19 @@ class CompaniesHouseClient:
         self.api_key = api_key or os.getenv("CH_API_KEY")
         # httpx.Timeout can be a float or per-phase config; a single float applies to connect/read/write
         self.timeout = httpx.Timeout(timeout)
+        # One pooled client per instance: auth headers are set once and
+        # keep-alive connections are reused across calls (no per-call TLS handshake)
         self._client = httpx.AsyncClient(
             timeout=self.timeout,
+            limits=httpx.Limits(
+                max_connections=20,
+                max_keepalive_connections=20,
+                keepalive_expiry=30.0,
+            ),
             headers={
                 "User-Agent": "detecktiv.io/preview (+contact: support@detecktiv.io)",
                 "Accept": "application/json",
+                **self._auth_headers(),
             },
         )
 
@@ -56,9 +64,7 @@ class CompaniesHouseClient:
         max_attempts = 5
         backoff = 0.5  # seconds
         for attempt in range(max_attempts):
-            resp = await self._client.get(
-                url, params=params, headers=self._auth_headers()
-            )
+            resp = await self._client.get(url, params=params)
             status = resp.status_code
 
             # Unauthorized -> don't retry
@@ -18,30 +18,37 @@ Examples:
 
 import asyncio
 import csv
+import json
 import logging
+import queue
 import sys
-from datetime import datetime, timedelta
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 from typing import List, Optional, Dict, Any
 
 import click
-from sqlalchemy.orm import Session
 
 # Add the app directory to Python path
 sys.path.insert(0, str(Path(__file__).parent))
 
 from app.core.config import settings
-from app.core.database import get_db_session, check_database_connection, startup_database
 from app.core.logging import setup_logging, get_logger
-from app.models.company import Company
-from app.services.company_service import CompanyService
-from app.services.companies_house_service import CompaniesHouseService
-from app.schemas.company import CompanyCreate
+
+# Database, ORM and service imports are deferred to the commands that use
+# them, so lightweight commands (e.g. check-config) don't pay for SQLAlchemy,
+# Pydantic schemas or HTTP clients at startup.
 
 # Initialize logging
 setup_logging()
 logger = get_logger(__name__)
 
+# Write buffer used for file exports
+EXPORT_BUFFER_SIZE = 1 << 20
+# Rows fetched from the DB and handed to the CSV writer per batch
+EXPORT_CHUNK_SIZE = 1000
+
 
 @click.group()
 @click.option('--verbose', '-v', is_flag=True, help='Enable verbose logging')
@@ -61,15 +68,19 @@ def check_config():
     """Check application configuration."""
     click.echo("🔧 Checking configuration...")
     
+    # Read each setting once up front
+    api_key = settings.companies_house_api_key
+    is_dev = settings.is_development()
+    
     # Database configuration
     click.echo(f"Database URL: {settings.get_database_url(mask_password=True)}")
-    click.echo(f"Environment: {settings.is_development() and 'Development' or 'Production'}")
+    click.echo(f"Environment: {'Development' if is_dev else 'Production'}")
     click.echo(f"Debug mode: {settings.debug}")
     click.echo(f"Log level: {settings.log_level}")
     
     # Companies House API
-    if settings.companies_house_api_key:
-        masked_key = settings.companies_house_api_key[:8] + "..." + settings.companies_house_api_key[-4:]
+    if api_key:
+        masked_key = api_key[:8] + "..." + api_key[-4:]
         click.echo(f"Companies House API key: {masked_key}")
     else:
         click.echo("⚠️  Companies House API key not configured")
@@ -85,6 +96,8 @@ def check_db():
     """Check database connectivity and status."""
     click.echo("🔍 Checking database connection...")
     
+    from app.core.database import check_database_connection
+
     is_connected, message = check_database_connection()
     
     if is_connected:
@@ -136,6 +149,11 @@ def db_seed(reset):
     
     click.echo("🌱 Seeding database with sample data...")
     
+    from app.core.database import get_db_session
+    from app.models.company import Company
+    from app.schemas.company import CompanyCreate
+    from app.services.company_service import CompanyService
+
     try:
         with get_db_session() as session:
             service = CompanyService(session)
@@ -253,6 +271,12 @@ def companies_house_sync(limit, force):
         sys.exit(1)
     
     click.echo(f"🏢 Syncing up to {limit} companies with Companies House...")
+
+    from sqlalchemy import or_
+    from app.core.database import get_db_session
+    from app.models.company import Company
+    from app.services.company_service import CompanyService
+    from app.services.companies_house_service import CompaniesHouseService
     
     async def sync_companies():
         success_count = 0
@@ -263,24 +287,29 @@ def companies_house_sync(limit, force):
                 service = CompanyService(session)
                 
                 # Get companies that have Companies House numbers
-                companies = session.query(Company).filter(
+                query = session.query(Company).filter(
                     Company.companies_house_number.isnot(None)
-                ).limit(limit).all()
+                )
+                if not force:
+                    # Skip companies updated within 7 days (filtered in the DB so
+                    # that `limit` bounds the companies we will actually sync)
+                    stale_before = datetime.now(timezone.utc) - timedelta(days=7)
+                    query = query.filter(
+                        or_(
+                            Company.last_updated_from_source.is_(None),
+                            Company.last_updated_from_source < stale_before,
+                        )
+                    )
+                companies = query.limit(limit).all()
                 
                 if not companies:
-                    click.echo("No companies found with Companies House numbers")
+                    click.echo("No companies found that need syncing")
                     return
                 
-                click.echo(f"Found {len(companies)} companies to potentially sync")
+                click.echo(f"Found {len(companies)} companies to sync")
                 
                 for company in companies:
                     try:
-                        # Check if sync is needed
-                        if not force and company.last_updated_from_source:
-                            days_ago = (datetime.utcnow() - company.last_updated_from_source).days
-                            if days_ago < 7:  # Skip if updated within 7 days
-                                continue
-                        
                         click.echo(f"Syncing: {company.name} ({company.companies_house_number})")
                         
                         success, message, updated_fields = await ch_service.update_company_from_companies_house(
@@ -309,50 +338,91 @@ def companies_house_sync(limit, force):
 def export_companies(output, output_format):
     """Export companies to CSV or JSON."""
     click.echo(f"📄 Exporting companies to {output}...")
+
+    from app.core.database import get_db_session
+    from app.models.company import Company
     
     try:
         with get_db_session() as session:
-            companies = session.query(Company).all()
-            
-            if not companies:
+            if session.query(Company.id).limit(1).first() is None:
                 click.echo("No companies found to export")
                 return
             
             output_path = Path(output)
             
             if output_format == 'csv':
-                with open(output_path, 'w', newline='', encoding='utf-8') as csvfile:
-                    # Define CSV columns
-                    fieldnames = [
-                        'id', 'name', 'website', 'email', 'phone',
-                        'address_line1', 'address_line2', 'city', 'county', 'postcode', 'country',
-                        'industry', 'sic_code', 'employee_count', 'annual_revenue',
-                        'companies_house_number', 'companies_house_status',
-                        'data_source', 'is_prospect', 'prospect_stage',
-                        'created_at', 'updated_at'
-                    ]
-                    
-                    writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-                    writer.writeheader()
+                # Define CSV columns
+                fieldnames = [
+                    'id', 'name', 'website', 'email', 'phone',
+                    'address_line1', 'address_line2', 'city', 'county', 'postcode', 'country',
+                    'industry', 'sic_code', 'employee_count', 'annual_revenue',
+                    'companies_house_number', 'companies_house_status',
+                    'data_source', 'is_prospect', 'prospect_stage',
+                    'created_at', 'updated_at'
+                ]
+                
+                # A producer thread streams companies from the DB in chunks while
+                # this thread writes the previous chunk, overlapping DB and disk I/O.
+                # The session is only used by the producer until it finishes.
+                chunks = queue.Queue(maxsize=4)
+                stop = threading.Event()
+                
+                def put_chunk(item) -> bool:
+                    # Give up if the writer has stopped, rather than block on a full queue
+                    while not stop.is_set():
+                        try:
+                            chunks.put(item, timeout=0.1)
+                            return True
+                        except queue.Full:
+                            continue
+                    return False
+                
+                def produce_chunks():
+                    try:
+                        chunk = []
+                        for company in session.query(Company).yield_per(EXPORT_CHUNK_SIZE):
+                            # Convert company to dict, handling datetime objects
+                            company_dict = company.to_dict()
+                            chunk.append([company_dict.get(field, '') for field in fieldnames])
+                            if len(chunk) >= EXPORT_CHUNK_SIZE:
+                                if not put_chunk(chunk):
+                                    return
+                                chunk = []
+                        if chunk and not put_chunk(chunk):
+                            return
+                        put_chunk(None)
+                    except Exception as e:
+                        put_chunk(e)
+                
+                exported_count = 0
+                # 1 MiB buffer: encode and flush to disk in large blocks rather than per row
+                with open(output_path, 'w', newline='', encoding='utf-8', buffering=EXPORT_BUFFER_SIZE) as csvfile, \
+                        ThreadPoolExecutor(max_workers=1) as executor:
+                    writer = csv.writer(csvfile)
+                    writer.writerow(fieldnames)
                     
-                    for company in companies:
-                        # Convert company to dict, handling datetime objects
-                        company_dict = company.to_dict()
-                        
-                        # Ensure all fieldnames are present
-                        row = {field: company_dict.get(field, '') for field in fieldnames}
-                        
-                        writer.writerow(row)
+                    executor.submit(produce_chunks)
+                    try:
+                        while True:
+                            chunk = chunks.get()
+                            if chunk is None:
+                                break
+                            if isinstance(chunk, Exception):
+                                raise chunk
+                            writer.writerows(chunk)
+                            exported_count += len(chunk)
+                    finally:
+                        stop.set()
             
             elif output_format == 'json':
-                import json
-                
+                companies = session.query(Company).all()
                 companies_data = [company.to_dict() for company in companies]
+                exported_count = len(companies_data)
                 
-                with open(output_path, 'w', encoding='utf-8') as jsonfile:
+                with open(output_path, 'w', encoding='utf-8', buffering=EXPORT_BUFFER_SIZE) as jsonfile:
                     json.dump(companies_data, jsonfile, indent=2, default=str)
             
-            click.echo(f"✅ Exported {len(companies)} companies to {output_path}")
+            click.echo(f"✅ Exported {exported_count} companies to {output_path}")
     
     except Exception as e:
         click.echo(f"❌ Export failed: {e}")
@@ -369,6 +439,16 @@ def import_companies(csv_file, dry_run):
     if dry_run:
         click.echo("🔍 DRY RUN MODE - No changes will be made")
     
+    from pydantic import TypeAdapter, ValidationError
+    from app.core.database import get_db_session
+    from app.schemas.company import CompanyCreate
+    from app.services.company_service import CompanyService
+
+    # Validating a whole batch through one list adapter lets pydantic-core
+    # amortise per-row overhead; rows are buffered in chunks of this size.
+    batch_size = 500
+    batch_adapter = TypeAdapter(List[CompanyCreate])
+    
     try:
         imported_count = 0
         skipped_count = 0
@@ -376,6 +456,71 @@ def import_companies(csv_file, dry_run):
         
         with get_db_session() as session:
             service = CompanyService(session)
+            # (line number, raw company fields, message): rows that failed or were
+            # skipped while reading carry only a message. Everything is reported
+            # by flush_pending so output stays in CSV order.
+            pending: List[tuple] = []
+            # Names imported (or, in a dry run, that would be) from this file;
+            # a name is only recorded once its row has validated.
+            queued_names = set()
+
+            def flush_pending():
+                nonlocal imported_count, skipped_count, error_count
+
+                if not pending:
+                    return
+                entries = list(pending)
+                pending.clear()
+                rows = [fields for _, fields, _ in entries if fields is not None]
+
+                # Validation messages keyed by position in `rows`
+                failed: Dict[int, List[str]] = {}
+                try:
+                    validated = batch_adapter.validate_python(rows)
+                except ValidationError as e:
+                    for err in e.errors():
+                        field = '.'.join(str(part) for part in err['loc'][1:])
+                        failed.setdefault(err['loc'][0], []).append(
+                            f"{field}: {err['msg']}" if field else err['msg']
+                        )
+                    # Re-validate the rest without the offending rows
+                    validated = batch_adapter.validate_python(
+                        [fields for i, fields in enumerate(rows) if i not in failed]
+                    )
+
+                valid = iter(validated)
+                row_idx = -1
+                for line_num, fields, message in entries:
+                    if fields is None:
+                        click.echo(message)
+                        continue
+                    row_idx += 1
+                    if row_idx in failed:
+                        error_count += 1
+                        click.echo(f"❌ Error processing row {line_num}: {'; '.join(failed[row_idx])}")
+                        continue
+                    company_data = next(valid)
+                    name = fields['name']
+
+                    # An earlier valid row in this file may have the same name
+                    if name in queued_names:
+                        skipped_count += 1
+                        if dry_run:
+                            click.echo(f"Would skip existing: {name}")
+                        continue
+                    try:
+                        if not dry_run:
+                            company = service.create_company(company_data)
+                            click.echo(f"Imported: {company.name}")
+                        else:
+                            click.echo(f"Would import: {company_data.name}")
+                        
+                        queued_names.add(name)
+                        imported_count += 1
+                        
+                    except Exception as e:
+                        error_count += 1
+                        click.echo(f"❌ Error processing row {line_num}: {e}")
             
             with open(csv_file, 'r', encoding='utf-8') as csvfile:
                 reader = csv.DictReader(csvfile)
@@ -386,16 +531,16 @@ def import_companies(csv_file, dry_run):
                         if not row.get('name', '').strip():
                             continue
                         
-                        # Check if company already exists
-                        existing = service.get_company_by_name(row['name'])
+                        # Check if company already exists (in the DB or earlier in this file)
+                        existing = row['name'] in queued_names or service.get_company_by_name(row['name'])
                         if existing:
                             skipped_count += 1
                             if dry_run:
-                                click.echo(f"Would skip existing: {row['name']}")
+                                pending.append((reader.line_num, None, f"Would skip existing: {row['name']}"))
                             continue
                         
-                        # Prepare company data
-                        company_data = CompanyCreate(
+                        # Prepare company data (validated in batches by flush_pending)
+                        pending.append((reader.line_num, dict(
                             name=row['name'],
                             website=row.get('website') or None,
                             email=row.get('email') or None,
@@ -411,19 +556,16 @@ def import_companies(csv_file, dry_run):
                             employee_count=int(row['employee_count']) if row.get('employee_count', '').strip() else None,
                             annual_revenue=int(row['annual_revenue']) if row.get('annual_revenue', '').strip() else None,
                             companies_house_number=row.get('companies_house_number') or None
-                        )
-                        
-                        if not dry_run:
-                            company = service.create_company(company_data)
-                            click.echo(f"Imported: {company.name}")
-                        else:
-                            click.echo(f"Would import: {company_data.name}")
-                        
-                        imported_count += 1
+                        ), None))
                         
                     except Exception as e:
                         error_count += 1
-                        click.echo(f"❌ Error processing row {reader.line_num}: {e}")
+                        pending.append((reader.line_num, None, f"❌ Error processing row {reader.line_num}: {e}"))
+
+                    if len(pending) >= batch_size:
+                        flush_pending()
+
+                flush_pending()
         
         if dry_run:
             click.echo(f"📊 DRY RUN SUMMARY: {imported_count} would be imported, {skipped_count} would be skipped, {error_count} errors")
@@ -442,41 +584,45 @@ def stats():
     click.echo("-" * 30)
     
     try:
-        with get_db_session() as session:
-            # Basic counts
-            total_companies = session.query(Company).count()
-            prospects = session.query(Company).filter(Company.is_prospect == True).count()
-            companies_house_linked = session.query(Company).filter(
-                Company.companies_house_number.isnot(None)
-            ).count()
+        # Read-only: use Core on the shared engine so the ORM is never configured
+        from sqlalchemy import text
+        from app.core.database import get_engine
+
+        with get_engine().connect() as conn:
+            # Basic counts (single round-trip using conditional aggregates)
+            total_companies, prospects, companies_house_linked = conn.execute(text(
+                "SELECT COUNT(*), "
+                "COUNT(*) FILTER (WHERE is_prospect), "
+                "COUNT(*) FILTER (WHERE company_number IS NOT NULL) "
+                "FROM companies"
+            )).one()
             
             click.echo(f"Total companies: {total_companies}")
             click.echo(f"Prospects: {prospects}")
             click.echo(f"Companies House linked: {companies_house_linked}")
             
-            # Country breakdown
-            from sqlalchemy import func
-            country_stats = session.query(
-                Company.country,
-                func.count(Company.id).label('count')
-            ).group_by(Company.country).all()
+            # Country breakdown and top 5 industries from a single scan:
+            # GROUPING(country) = 1 marks rows from the (industry) grouping set
+            breakdown = conn.execute(text(
+                "WITH grouped AS ("
+                "  SELECT GROUPING(country) AS by_industry, country, industry, COUNT(*) AS n"
+                "  FROM companies GROUP BY GROUPING SETS ((country), (industry))"
+                "), ranked AS ("
+                "  SELECT by_industry, country, industry, n,"
+                "         ROW_NUMBER() OVER (PARTITION BY by_industry ORDER BY n DESC) AS rn"
+                "  FROM grouped WHERE by_industry = 0 OR industry IS NOT NULL"
+                ") "
+                "SELECT by_industry, country, industry, n FROM ranked "
+                "WHERE by_industry = 0 OR rn <= 5 "
+                "ORDER BY by_industry, n DESC"
+            )).all()
+            country_stats = [(country, n) for by_industry, country, _, n in breakdown if not by_industry]
+            industry_stats = [(industry, n) for by_industry, _, industry, n in breakdown if by_industry]
             
             click.echo("\nBy Country:")
             for country, count in country_stats:
                 click.echo(f"  {country}: {count}")
             
-            # Industry breakdown (top 5)
-            industry_stats = session.query(
-                Company.industry,
-                func.count(Company.id).label('count')
-            ).filter(
-                Company.industry.isnot(None)
-            ).group_by(
-                Company.industry
-            ).order_by(
-                func.count(Company.id).desc()
-            ).limit(5).all()
-            
             if industry_stats:
                 click.echo("\nTop Industries:")
                 for industry, count in industry_stats:
@@ -6,6 +6,8 @@ from urllib.parse import quote_plus
 from sqlalchemy import create_engine
 from sqlalchemy.engine import Engine
 
+from app.db_url import mask_dsn
+
 
 def db_url(mask_password: bool = False) -> str:
     user = os.getenv("POSTGRES_USER", "postgres")
@@ -19,7 +21,7 @@ def db_url(mask_password: bool = False) -> str:
     url = f"postgresql+psycopg2://{safe_user}:{safe_pw}@{host}:{port}/{dbname}?sslmode=disable"
 
     if mask_password and password:
-        return url.replace(safe_pw, "***")
+        return mask_dsn(url)
     return url
 
 
@@ -0,0 +1,67 @@
+# db/migrations/_env_utils.py
+"""
+Side-effect-free helpers for the Alembic environment.
+
+env.py runs migrations as soon as it is imported; everything here can be
+imported on its own (e.g. from tests) without touching Alembic's context.
+"""
+
+from __future__ import annotations
+
+import os
+from functools import lru_cache
+from urllib.parse import quote_plus
+
+from app.db_url import mask_dsn
+
+# libpq variables pgAdmin may set that the generated URL doesn't override
+_PG_ENV_CONFLICTS = (
+    "PGSERVICE",
+    "PGSERVICEFILE",
+    "PGOPTIONS",
+    "PGSSLMODE",
+    "PGAPPNAME",
+    "PGTARGETSESSIONATTRS",
+)
+
+
+def scrub_pg_env() -> None:
+    """Remove conflicting PG* environment variables before connecting."""
+    for k in _PG_ENV_CONFLICTS:
+        os.environ.pop(k, None)
+
+
+@lru_cache(maxsize=1)
+def get_database_url() -> str:
+    """
+    Get database URL from environment or settings.
+
+    Uses the same configuration system as the main application
+    to ensure consistency. The result is cached for the life of the
+    process; call ``get_database_url.cache_clear()`` to re-read it.
+    """
+    try:
+        # Try to use the settings module first. Imported here so pydantic
+        # settings are only built when a URL is actually needed.
+        from app.core.config import settings
+
+        return settings.get_database_url()
+    except Exception:
+        # Fallback to manual construction if settings fail
+        user = os.getenv("POSTGRES_USER", "postgres")
+        password = os.getenv("POSTGRES_PASSWORD", "")
+        host = os.getenv("POSTGRES_HOST", "127.0.0.1")
+        port = os.getenv("POSTGRES_PORT", "5432")
+        database = os.getenv("POSTGRES_DB", "detecktiv")
+        sslmode = os.getenv("POSTGRES_SSLMODE", "disable")
+
+        # URL-encode credentials to handle special characters
+        user_encoded = quote_plus(user)
+        password_encoded = quote_plus(password)
+
+        return f"postgresql+psycopg2://{user_encoded}:{password_encoded}@{host}:{port}/{database}?sslmode={sslmode}"
+
+
+def get_database_url_masked() -> str:
+    """Get database URL with password masked for logging."""
+    return mask_dsn(get_database_url())
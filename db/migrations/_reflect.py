@@ -0,0 +1,127 @@
+# db/migrations/_reflect.py
+"""
+Catalog lookups shared by the idempotent migrations.
+
+One query returns every existence fact the migrations need (tables, columns,
+unique column sets, check constraint names, INVALID indexes) for a handful of tables, instead of one
+Inspector query per table per artifact kind. The result is a plain dict
+snapshot: take it at the start of ``upgrade()`` and patch or retake it after
+DDL that changes what later checks read. Snapshots are deliberately not
+shared between migrations, since each one's DDL makes the previous snapshot
+stale.
+"""
+
+from __future__ import annotations
+
+import logging
+
+import sqlalchemy as sa
+from alembic import op
+
+log = logging.getLogger("alembic.runtime.migration")
+
+CATALOG_SQL = sa.text(
+    """
+    WITH rel AS (
+        SELECT c.oid, c.relname
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = current_schema()
+          AND c.relkind IN ('r', 'p')
+          AND c.relname = ANY(:tables)
+    )
+    SELECT 'table' AS kind, rel.relname AS tbl, NULL::text AS name,
+           NULL::text[] AS cols
+    FROM rel
+    UNION ALL
+    SELECT 'column', rel.relname, a.attname::text, NULL
+    FROM rel
+    JOIN pg_attribute a ON a.attrelid = rel.oid
+    WHERE a.attnum > 0 AND NOT a.attisdropped
+    UNION ALL
+    SELECT 'unique', rel.relname, con.conname::text,
+           ARRAY(
+               SELECT a.attname::text
+               FROM unnest(con.conkey) AS k(attnum)
+               JOIN pg_attribute a
+                 ON a.attrelid = con.conrelid AND a.attnum = k.attnum
+           )
+    FROM rel
+    JOIN pg_constraint con ON con.conrelid = rel.oid
+    WHERE con.contype = 'u'
+    UNION ALL
+    SELECT 'check', rel.relname, con.conname::text, NULL
+    FROM rel
+    JOIN pg_constraint con ON con.conrelid = rel.oid
+    WHERE con.contype = 'c'
+    UNION ALL
+    SELECT 'invalid_index', rel.relname, ic.relname::text, NULL
+    FROM rel
+    JOIN pg_index i ON i.indrelid = rel.oid
+    JOIN pg_class ic ON ic.oid = i.indexrelid
+    WHERE NOT i.indisvalid
+    """
+)
+
+
+def catalog_snapshot(conn, tables) -> dict:
+    """Load tables, columns, constraints and INVALID indexes in one query."""
+    cat = {
+        "tables": set(),
+        "columns": {},
+        "uniques": {},
+        "checks": {},
+        "invalid_indexes": {},
+    }
+    rows = conn.execute(CATALOG_SQL, {"tables": list(tables)})
+    for kind, tbl, name, cols in rows:
+        if kind == "table":
+            cat["tables"].add(tbl)
+        elif kind == "column":
+            cat["columns"].setdefault(tbl, set()).add(name)
+        elif kind == "unique":
+            cat["uniques"].setdefault(tbl, set()).add(frozenset(cols))
+        elif kind == "check":
+            cat["checks"].setdefault(tbl, set()).add(name)
+        elif kind == "invalid_index":
+            cat["invalid_indexes"].setdefault(tbl, set()).add(name)
+    return cat
+
+
+def has_table(cat: dict, name: str) -> bool:
+    return name in cat["tables"]
+
+
+def has_column(cat: dict, table: str, col: str) -> bool:
+    return col in cat["columns"].get(table, ())
+
+
+def unique_column_sets(cat: dict, table: str) -> set[frozenset[str]]:
+    """Unique constraints on ``table`` as column sets, whatever their name/order."""
+    return cat["uniques"].get(table, set())
+
+
+def check_constraints(cat: dict, table: str) -> set[str]:
+    """Names of CHECK constraints on ``table`` (valid or NOT VALID)."""
+    return cat["checks"].get(table, set())
+
+
+def invalid_indexes(cat: dict, table: str) -> set[str]:
+    """Names of indexes on ``table`` that Postgres marks INVALID."""
+    return cat["invalid_indexes"].get(table, set())
+
+
+def drop_invalid_indexes(cat: dict, table: str, names) -> None:
+    """Drop any of ``names`` left INVALID on ``table`` so they can be rebuilt.
+
+    An interrupted ``CREATE INDEX CONCURRENTLY`` leaves its index behind as
+    INVALID: never used by queries but still maintained on every write, and
+    ``IF NOT EXISTS`` would skip rebuilding it. Call inside
+    ``autocommit_block()``, before the concurrent builds.
+    """
+    for name in sorted(invalid_indexes(cat, table) & set(names)):
+        log.warning("Dropping INVALID index %s left by an interrupted build", name)
+        op.drop_index(
+            name, table_name=table, if_exists=True, postgresql_concurrently=True
+        )
+        invalid_indexes(cat, table).discard(name)
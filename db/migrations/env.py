@@ -1,8 +1,9 @@
-# db/migrations/env_enhanced.py
+# db/migrations/env.py
 """
-Enhanced Alembic migration environment for Detecktiv.io.
+Alembic migration environment for Detecktiv.io.
 
-This replaces the existing env.py with improved support for:
+URL construction and environment cleanup live in ``_env_utils`` so they can
+be imported without running migrations. This environment provides:
 - SQLAlchemy 2.0 models and metadata
 - Better error handling and logging
 - Support for both online and offline migrations
@@ -11,16 +12,21 @@ This replaces the existing env.py with improved support for:
 
 from __future__ import annotations
 
+import logging
 import os
 import sys
 from logging.config import fileConfig
 from pathlib import Path
-from urllib.parse import quote_plus
 
 from alembic import context
-from sqlalchemy import pool, create_engine, text
+from sqlalchemy import pool, create_engine
+from sqlalchemy.exc import OperationalError
 from dotenv import load_dotenv
 
+# Progress/diagnostics go through the "alembic" logger hierarchy configured
+# in alembic.ini (INFO to stderr), not print().
+log = logging.getLogger("alembic.env")
+
 # Add the project root to Python path so we can import our models
 project_root = Path(__file__).resolve().parents[2]
 sys.path.insert(0, str(project_root))
@@ -28,10 +34,14 @@ sys.path.insert(0, str(project_root))
 # Import our models and configuration
 try:
     from app.models import Base  # This imports all models via __init__.py
-    from app.core.config import settings
+    from db.migrations._env_utils import (
+        get_database_url,
+        get_database_url_masked,
+        scrub_pg_env,
+    )
 except ImportError as e:
-    print(f"Failed to import application modules: {e}")
-    print(
+    log.error("Failed to import application modules: %s", e)
+    log.error(
         "Make sure you're running from the project root and dependencies are installed"
     )
     sys.exit(1)
@@ -44,69 +54,20 @@ if config.config_file_name is not None:
     fileConfig(config.config_file_name)
 
 # Clean any conflicting PG* environment variables that might be set by pgAdmin
-for k in list(os.environ.keys()):
-    if k.startswith("PG") and k not in [
-        "PGPASSWORD",
-        "PGUSER",
-        "PGHOST",
-        "PGPORT",
-        "PGDATABASE",
-    ]:
-        os.environ.pop(k, None)
-
-# Load environment variables
-load_dotenv(project_root / ".env")
+scrub_pg_env()
+
+# Load environment variables, unless the caller (CI, docker) already did
+if "POSTGRES_DB" not in os.environ:
+    load_dotenv(project_root / ".env")
 
 # Set target metadata for autogenerate support
 target_metadata = Base.metadata
 
-
-def get_database_url() -> str:
-    """
-    Get database URL from environment or settings.
-
-    Uses the same configuration system as the main application
-    to ensure consistency.
-    """
-    try:
-        # Try to use the settings module first
-        return settings.get_database_url()
-    except Exception:
-        # Fallback to manual construction if settings fail
-        user = os.getenv("POSTGRES_USER", "postgres")
-        password = os.getenv("POSTGRES_PASSWORD", "")
-        host = os.getenv("POSTGRES_HOST", "127.0.0.1")
-        port = os.getenv("POSTGRES_PORT", "5432")
-        database = os.getenv("POSTGRES_DB", "detecktiv")
-        sslmode = os.getenv("POSTGRES_SSLMODE", "disable")
-
-        # URL-encode credentials to handle special characters
-        user_encoded = quote_plus(user)
-        password_encoded = quote_plus(password)
-
-        return f"postgresql+psycopg2://{user_encoded}:{password_encoded}@{host}:{port}/{database}?sslmode={sslmode}"
-
-
-def get_database_url_masked() -> str:
-    """Get database URL with password masked for logging."""
-    url = get_database_url()
-    if ":" in url and "@" in url:
-        # Replace password with ***
-        parts = url.split("://")[1].split("@")
-        if len(parts) == 2:
-            user_pass = parts[0]
-            if ":" in user_pass:
-                user = user_pass.split(":")[0]
-                masked_url = url.replace(user_pass, f"{user}:***")
-                return masked_url
-    return url
-
-
 # Set the database URL in the alembic configuration
 database_url = get_database_url()
 config.set_main_option("sqlalchemy.url", database_url)
 
-print(f"Using database URL: {get_database_url_masked()}")
+log.info("Using database URL: %s", get_database_url_masked())
 
 
 def include_object(object, name, type_, reflected, compare_to):
@@ -158,26 +119,37 @@ def run_migrations_online() -> None:
     In this scenario we need to create an Engine
     and associate a connection with the context.
     """
+    # Only online mode needs the DBAPI; offline SQL generation never loads it.
+    try:
+        import psycopg2  # noqa: F401
+    except ImportError:
+        log.error("psycopg2 not available. Install with: pip install psycopg2-binary")
+        sys.exit(1)
+
     # Create engine with SQLAlchemy 2.0 compatibility
     connectable = create_engine(
         database_url,
         future=True,  # Enable SQLAlchemy 2.0 mode
-        poolclass=pool.NullPool,  # Don't use connection pooling for migrations
+        # One DBAPI connection for the whole run: any extra checkout (e.g. a
+        # dialect probe) reuses it instead of paying a fresh handshake.
+        poolclass=pool.StaticPool,
+        connect_args={"application_name": "alembic"},
         echo=False,  # Set to True for SQL debugging
     )
 
-    with connectable.connect() as connection:
-        # Test the connection
-        try:
-            connection.execute(text("SELECT 1"))
-            print("✅ Database connection successful")
-        except Exception as e:
-            print(f"❌ Database connection failed: {e}")
-            print(
-                "Please check your database configuration and ensure PostgreSQL is running"
-            )
-            sys.exit(1)
+    # No separate SELECT 1 probe: connect() surfaces a dead or misconfigured
+    # database on the first real trip. Only that is reported as a connection
+    # failure; OperationalErrors raised by a migration propagate unchanged.
+    try:
+        connection = connectable.connect()
+    except OperationalError as e:
+        log.error("Database connection failed: %s", e)
+        log.error(
+            "Please check your database configuration and ensure PostgreSQL is running"
+        )
+        sys.exit(1)
 
+    with connection:
         context.configure(
             connection=connection,
             target_metadata=target_metadata,
@@ -186,6 +158,9 @@ def run_migrations_online() -> None:
             include_object=include_object,
             # Enable autogenerate for better migration detection
             process_revision_directives=process_revision_directives,
+            # Commit per revision: an autocommit_block() then only commits the
+            # revision it is in, and alembic_version tracks each one as it lands.
+            transaction_per_migration=True,
         )
 
         with context.begin_transaction():
@@ -209,35 +184,17 @@ def process_revision_directives(context, revision, directives):
     pass
 
 
-def validate_environment():
-    """Validate that the environment is properly configured."""
-    required_vars = ["POSTGRES_USER", "POSTGRES_DB"]
-    missing_vars = []
-
-    for var in required_vars:
-        if not os.getenv(var):
-            missing_vars.append(var)
-
-    if missing_vars:
-        print(f"❌ Missing required environment variables: {', '.join(missing_vars)}")
-        print("Please ensure your .env file is properly configured")
-        sys.exit(1)
-
-    # Check if we can import required modules
-    try:
-        import psycopg2  # noqa: F401
-    except ImportError:
-        print("❌ psycopg2 not available. Install with: pip install psycopg2-binary")
-        sys.exit(1)
-
-
 # Validate environment before running migrations
-validate_environment()
+_missing_vars = [v for v in ("POSTGRES_USER", "POSTGRES_DB") if not os.getenv(v)]
+if _missing_vars:
+    log.error("Missing required environment variables: %s", ", ".join(_missing_vars))
+    log.error("Please ensure your .env file is properly configured")
+    sys.exit(1)
 
 # Run migrations based on context
 if context.is_offline_mode():
-    print("Running migrations in offline mode...")
+    log.info("Running migrations in offline mode...")
     run_migrations_offline()
 else:
-    print("Running migrations in online mode...")
+    log.info("Running migrations in online mode...")
     run_migrations_online()
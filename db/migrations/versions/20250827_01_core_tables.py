@@ -8,6 +8,13 @@ Create Date: 2025-08-27
 from alembic import op
 import sqlalchemy as sa
 
+from db.migrations._reflect import (
+    catalog_snapshot,
+    has_column,
+    has_table,
+    unique_column_sets,
+)
+
 # revision identifiers, used by Alembic.
 revision = "20250827_01_core_tables"
 down_revision = "a2f9e70c0e4a"
@@ -15,96 +22,53 @@ branch_labels = None
 depends_on = None
 
 
-# ---------- helpers ----------
-def _insp(conn):
-    return sa.inspect(conn)
-
-
-def _has_table(conn, name: str) -> bool:
-    try:
-        return name in _insp(conn).get_table_names()
-    except Exception:
-        return False
-
-
-def _has_column(conn, table: str, col: str) -> bool:
-    try:
-        cols = [c["name"] for c in _insp(conn).get_columns(table)]
-        return col in cols
-    except Exception:
-        return False
-
-
-def _index_names(conn, table: str) -> set[str]:
-    try:
-        return {idx["name"] for idx in _insp(conn).get_indexes(table)}
-    except Exception:
-        return set()
-
-
-def _unique_constraints_by_cols(conn, table: str) -> set[tuple[str, ...]]:
-    try:
-        uqs = set()
-        for uc in _insp(conn).get_unique_constraints(table):
-            cols = tuple(uc.get("column_names") or ())
-            if cols:
-                uqs.add(cols)
-        return uqs
-    except Exception:
-        return set()
-
-
-def _fk_exists(
-    conn, table: str, constrained_cols: tuple[str, ...], referred_table: str
-) -> bool:
-    try:
-        for fk in _insp(conn).get_foreign_keys(table):
-            if (
-                tuple(fk.get("constrained_columns") or ()) == constrained_cols
-                and fk.get("referred_table") == referred_table
-            ):
-                return True
-        return False
-    except Exception:
-        return False
+# Tables whose catalog facts upgrade() reads up front.
+_TABLES = ("tenants", "companies", "source_events")
 
 
 def upgrade():
     conn = op.get_bind()
+    if conn.dialect.name != "postgresql":
+        raise RuntimeError(
+            f"{revision} reads pg_catalog and requires PostgreSQL, "
+            f"not {conn.dialect.name}"
+        )
+    cat = catalog_snapshot(conn, _TABLES)
 
     # ---------- tenants ----------
-    if not _has_table(conn, "tenants"):
-        op.create_table(
-            "tenants",
-            sa.Column("id", sa.Integer, primary_key=True),
-            sa.Column("tenant_key", sa.String(length=64), nullable=False, unique=True),
-            sa.Column("name", sa.String(length=200), nullable=False),
-            sa.Column(
-                "created_at",
-                sa.DateTime(timezone=True),
-                server_default=sa.text("now()"),
-                nullable=False,
-            ),
-        )
+    op.create_table(
+        "tenants",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("tenant_key", sa.String(length=64), nullable=False, unique=True),
+        sa.Column("name", sa.String(length=200), nullable=False),
+        sa.Column(
+            "created_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        if_not_exists=True,
+    )
 
-    # Ensure a default tenant row is present (idempotent upsert)
-    op.execute(
+    # Ensure a default tenant row is present and get its id (needed for
+    # backfilling companies.tenant_id) in one round trip. DO UPDATE rather
+    # than DO NOTHING, which would suppress RETURNING on conflict.
+    default_tenant_id = conn.execute(
         sa.text(
             """
         INSERT INTO tenants (tenant_key, name)
         VALUES ('default', 'Default Tenant')
-        ON CONFLICT (tenant_key) DO NOTHING
+        ON CONFLICT (tenant_key) DO UPDATE SET tenant_key = EXCLUDED.tenant_key
+        RETURNING id
     """
         )
-    )
-
-    # We will need this for backfilling companies.tenant_id
-    default_tenant_id = conn.execute(
-        sa.text("SELECT id FROM tenants WHERE tenant_key = 'default'")
     ).scalar_one()
+    # Later migrations in the same run (688912b9c82b) read it from here.
+    conn.info["default_tenant_id"] = default_tenant_id
 
     # ---------- companies ----------
-    if not _has_table(conn, "companies"):
+    companies_existed = has_table(cat, "companies")
+    if not companies_existed:
         # Fresh create (includes tenant_id as NOT NULL with FK)
         op.create_table(
             "companies",
@@ -136,123 +100,81 @@ def upgrade():
                 name="uq_companies_tenant_company_number",
             ),
         )
-    else:
-        # Table exists already. Ensure tenant_id is present and enforced safely.
-        if not _has_column(conn, "companies", "tenant_id"):
-            # 1) add nullable
-            op.add_column(
-                "companies", sa.Column("tenant_id", sa.Integer(), nullable=True)
-            )
-            # 2) backfill to default tenant  ✅ FIXED PARAM BINDING
-            conn.execute(
-                sa.text(
-                    "UPDATE companies SET tenant_id = :tid WHERE tenant_id IS NULL"
-                ),
-                {"tid": default_tenant_id},
+    elif not has_column(cat, "companies", "tenant_id"):
+        # Table exists already without tenant_id. Add, backfill and enforce it
+        # in one statement: a constant DEFAULT takes Postgres' fast-default
+        # path, so existing rows get the default tenant without a separate
+        # UPDATE pass, and the FK is validated once against final values.
+        op.execute(
+            sa.text(
+                "ALTER TABLE companies ADD COLUMN tenant_id INTEGER NOT NULL "
+                f"DEFAULT {int(default_tenant_id)} REFERENCES tenants(id)"
             )
-            # 3) add FK if missing
-            if not _fk_exists(conn, "companies", ("tenant_id",), "tenants"):
-                op.create_foreign_key(
-                    None, "companies", "tenants", ["tenant_id"], ["id"]
-                )
-            # 4) enforce NOT NULL
-            op.alter_column("companies", "tenant_id", nullable=False)
-
-    # Ensure expected company indexes / unique constraint exist regardless of table origin.
-    if _has_table(conn, "companies"):
-        comp_idx = _index_names(conn, "companies")
-        comp_uqs = _unique_constraints_by_cols(conn, "companies")
-
-        # Indexes
-        if "ix_companies_tenant_id" not in comp_idx and _has_column(
-            conn, "companies", "tenant_id"
-        ):
-            try:
-                op.create_index("ix_companies_tenant_id", "companies", ["tenant_id"])
-            except Exception:  # nosec B110
-                pass
+        )
+        op.execute(sa.text("ALTER TABLE companies ALTER COLUMN tenant_id DROP DEFAULT"))
 
-        if "ix_companies_company_number" not in comp_idx and _has_column(
-            conn, "companies", "company_number"
-        ):
-            try:
-                op.create_index(
-                    "ix_companies_company_number", "companies", ["company_number"]
-                )
-            except Exception:  # nosec B110
-                pass
+    # Ensure expected company indexes / unique constraint exist regardless of
+    # table origin. tenant_id is guaranteed by now; company_number only comes
+    # with a fresh create or a pre-existing column.
+    has_company_number = not companies_existed or has_column(
+        cat, "companies", "company_number"
+    )
+    op.create_index(
+        "ix_companies_tenant_id", "companies", ["tenant_id"], if_not_exists=True
+    )
+    if has_company_number:
+        op.create_index(
+            "ix_companies_company_number",
+            "companies",
+            ["company_number"],
+            if_not_exists=True,
+        )
 
-        # Unique constraint on (tenant_id, company_number)
-        # Check both column orderings as Alembic/DB may report in different order.
-        need_uq = True
-        if ("tenant_id", "company_number") in comp_uqs or (
-            "company_number",
-            "tenant_id",
-        ) in comp_uqs:
-            need_uq = False
-        if (
-            need_uq
-            and _has_column(conn, "companies", "tenant_id")
-            and _has_column(conn, "companies", "company_number")
-        ):
-            try:
-                op.create_unique_constraint(
-                    "uq_companies_tenant_company_number",
-                    "companies",
-                    ["tenant_id", "company_number"],
-                )
-            except Exception:  # nosec B110
-                # If a similar constraint exists under a different name, ignore.
-                pass
+    # Unique constraint on (tenant_id, company_number), in either column order
+    # and under any name. Postgres has no ADD CONSTRAINT IF NOT EXISTS, so the
+    # column-set check stays; it is answered from the snapshot.
+    if (
+        companies_existed
+        and has_company_number
+        and frozenset(("tenant_id", "company_number"))
+        not in unique_column_sets(cat, "companies")
+    ):
+        op.create_unique_constraint(
+            "uq_companies_tenant_company_number",
+            "companies",
+            ["tenant_id", "company_number"],
+        )
 
     # ---------- source_events ----------
-    # Create only when dependencies exist to avoid FK creation failures.
-    if _has_table(conn, "tenants") and _has_table(conn, "companies"):
-        if not _has_table(conn, "source_events"):
-            op.create_table(
-                "source_events",
-                sa.Column("id", sa.Integer, primary_key=True),
-                sa.Column(
-                    "tenant_id", sa.Integer, sa.ForeignKey("tenants.id"), nullable=False
-                ),
-                sa.Column(
-                    "company_id",
-                    sa.Integer,
-                    sa.ForeignKey("companies.id"),
-                    nullable=False,
-                ),
-                sa.Column("source", sa.String(length=64), nullable=False),
-                sa.Column("kind", sa.String(length=64), nullable=False),
-                sa.Column("payload", sa.JSON()),
-                sa.Column(
-                    "created_at",
-                    sa.DateTime(timezone=True),
-                    server_default=sa.text("now()"),
-                    nullable=False,
-                ),
+    # tenants and companies both exist at this point, so the FKs resolve.
+    se_existed = has_table(cat, "source_events")
+    op.create_table(
+        "source_events",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("tenant_id", sa.Integer, sa.ForeignKey("tenants.id"), nullable=False),
+        sa.Column(
+            "company_id",
+            sa.Integer,
+            sa.ForeignKey("companies.id"),
+            nullable=False,
+        ),
+        sa.Column("source", sa.String(length=64), nullable=False),
+        sa.Column("kind", sa.String(length=64), nullable=False),
+        sa.Column("payload", sa.JSON()),
+        sa.Column(
+            "created_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        if_not_exists=True,
+    )
+    for col in ("tenant_id", "company_id"):
+        if not se_existed or has_column(cat, "source_events", col):
+            op.create_index(
+                f"ix_source_events_{col}", "source_events", [col], if_not_exists=True
             )
 
-        if _has_table(conn, "source_events"):
-            se_idx = _index_names(conn, "source_events")
-            if "ix_source_events_tenant_id" not in se_idx and _has_column(
-                conn, "source_events", "tenant_id"
-            ):
-                try:
-                    op.create_index(
-                        "ix_source_events_tenant_id", "source_events", ["tenant_id"]
-                    )
-                except Exception:  # nosec B110
-                    pass
-            if "ix_source_events_company_id" not in se_idx and _has_column(
-                conn, "source_events", "company_id"
-            ):
-                try:
-                    op.create_index(
-                        "ix_source_events_company_id", "source_events", ["company_id"]
-                    )
-                except Exception:  # nosec B110
-                    pass
-
 
 def downgrade():
     # Drop only what this migration introduces, and be defensive.
@@ -1,7 +1,18 @@
 """ensure tenants/source_events exist (idempotent), and enforce companies.tenant_id"""
 
+import logging
+
 from alembic import op
 import sqlalchemy as sa
+from sqlalchemy.exc import DBAPIError, IntegrityError
+
+from db.migrations._reflect import (
+    catalog_snapshot,
+    drop_invalid_indexes,
+    has_column,
+    has_table,
+    unique_column_sets,
+)
 
 # Use the current head from your repo as down_revision (merge rev).
 # If `python -m alembic heads` prints a different id, put that here.
@@ -10,126 +21,124 @@ down_revision = "8782f557b2eb"
 branch_labels = None
 depends_on = None
 
+# Tables whose catalog facts upgrade() reads up front.
+_TABLES = ("tenants", "companies", "source_events")
 
-def _insp(conn):
-    return sa.inspect(conn)
-
-
-def _has_table(conn, name: str) -> bool:
-    try:
-        return name in _insp(conn).get_table_names()
-    except Exception:
-        return False
-
-
-def _has_column(conn, table: str, col: str) -> bool:
-    try:
-        return col in [c["name"] for c in _insp(conn).get_columns(table)]
-    except Exception:
-        return False
-
-
-def _index_names(conn, table: str) -> set[str]:
-    try:
-        return {ix["name"] for ix in _insp(conn).get_indexes(table)}
-    except Exception:
-        return set()
-
-
-def _unique_constraints_by_cols(conn, table: str) -> set[tuple[str, ...]]:
-    try:
-        uqs = set()
-        for uc in _insp(conn).get_unique_constraints(table):
-            cols = tuple(uc.get("column_names") or ())
-            if cols:
-                uqs.add(cols)
-        return uqs
-    except Exception:
-        return set()
-
-
-def _fk_exists(conn, table: str, columns: tuple[str, ...], ref_table: str) -> bool:
-    try:
-        for fk in _insp(conn).get_foreign_keys(table):
-            if tuple(fk.get("constrained_columns") or ()) == columns and fk.get("referred_table") == ref_table:
-                return True
-        return False
-    except Exception:
-        return False
+log = logging.getLogger("alembic.runtime.migration")
 
 
 def upgrade():
     conn = op.get_bind()
+    cat = catalog_snapshot(conn, _TABLES)
 
     # 1) tenants (create if missing)
-    if not _has_table(conn, "tenants"):
-        op.create_table(
-            "tenants",
-            sa.Column("id", sa.Integer, primary_key=True),
-            sa.Column("tenant_key", sa.String(length=64), nullable=False, unique=True),
-            sa.Column("name", sa.String(length=200), nullable=False),
-            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=False),
-        )
-
-    default_tenant_id = None
-    if _has_table(conn, "tenants"):
-        # upsert default tenant
-        op.execute(
+    # 20250827_01 stashes the default tenant id on the connection; reuse it
+    # when this runs in the same upgrade and tenants was already there.
+    default_tenant_id = conn.info.get("default_tenant_id") if has_table(cat, "tenants") else None
+    op.create_table(
+        "tenants",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("tenant_key", sa.String(length=64), nullable=False, unique=True),
+        sa.Column("name", sa.String(length=200), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=False),
+        if_not_exists=True,
+    )
+    # tenants exists from here on; the checks below don't need to ask again.
+
+    if default_tenant_id is None:
+        # upsert default tenant and get its id in one round trip; the UNION
+        # branch covers the row already existing (DO NOTHING returns nothing)
+        default_tenant_id = conn.execute(
             sa.text(
-                "INSERT INTO tenants (tenant_key, name) "
-                "VALUES ('default', 'Default Tenant') "
-                "ON CONFLICT (tenant_key) DO NOTHING"
+                "WITH ins AS ("
+                "  INSERT INTO tenants (tenant_key, name) "
+                "  VALUES ('default', 'Default Tenant') "
+                "  ON CONFLICT (tenant_key) DO NOTHING "
+                "  RETURNING id"
+                ") "
+                "SELECT id FROM ins "
+                "UNION ALL "
+                "SELECT id FROM tenants WHERE tenant_key = 'default' "
+                "LIMIT 1"
             )
-        )
-        default_tenant_id = conn.execute(sa.text("SELECT id FROM tenants WHERE tenant_key='default'")).scalar()
+        ).scalar()
 
     # 2) companies.tenant_id (add/backfill/enforce) if companies table exists
-    if _has_table(conn, "companies"):
-        if not _has_column(conn, "companies", "tenant_id"):
-            op.add_column("companies", sa.Column("tenant_id", sa.Integer(), nullable=True))
-
-            if default_tenant_id is not None:
-                conn.execute(
-                    sa.text("UPDATE companies SET tenant_id = :tid WHERE tenant_id IS NULL"),
-                    {"tid": default_tenant_id},
+    if has_table(cat, "companies"):
+        if not has_column(cat, "companies", "tenant_id"):
+            # Add, backfill to the default tenant and enforce in one statement:
+            # a constant DEFAULT takes Postgres' fast-default path (no UPDATE
+            # pass) and the FK is validated once against the final values.
+            op.execute(
+                sa.text(
+                    "ALTER TABLE companies ADD COLUMN IF NOT EXISTS tenant_id INTEGER NOT NULL "
+                    f"DEFAULT {int(default_tenant_id)} REFERENCES tenants(id)"
                 )
-
-            if _has_table(conn, "tenants") and not _fk_exists(conn, "companies", ("tenant_id",), "tenants"):
-                op.create_foreign_key(None, "companies", "tenants", ["tenant_id"], ["id"])
-
-            # Only enforce NOT NULL if we have a default tenant to backfill
-            if default_tenant_id is not None:
-                op.alter_column("companies", "tenant_id", nullable=False)
+            )
+            op.execute(sa.text("ALTER TABLE companies ALTER COLUMN tenant_id DROP DEFAULT"))
+            # Only the column set changed; no need to re-read the catalog.
+            cat["columns"]["companies"].add("tenant_id")
 
         # Ensure indexes/UQ
-        comp_idx = _index_names(conn, "companies")
-        comp_uqs = _unique_constraints_by_cols(conn, "companies")
-
-        if "ix_companies_tenant_id" not in comp_idx and _has_column(conn, "companies", "tenant_id"):
-            try:
-                op.create_index("ix_companies_tenant_id", "companies", ["tenant_id"])
-            except Exception:
-                pass
-
-        if "ix_companies_company_number" not in comp_idx and _has_column(conn, "companies", "company_number"):
-            try:
-                op.create_index("ix_companies_company_number", "companies", ["company_number"])
-            except Exception:
-                pass
+        comp_uqs = unique_column_sets(cat, "companies")
+
+        # companies may already hold data here, so build without blocking
+        # writes. CONCURRENTLY can't run inside a transaction: autocommit_block
+        # commits this migration so far and resumes a new transaction afterwards.
+        with op.get_context().autocommit_block():
+            drop_invalid_indexes(cat, "companies", ("ix_companies_tenant_id", "ix_companies_company_number"))
+            if has_column(cat, "companies", "tenant_id"):
+                op.create_index(
+                    "ix_companies_tenant_id",
+                    "companies",
+                    ["tenant_id"],
+                    if_not_exists=True,
+                    postgresql_concurrently=True,
+                )
 
-        need_uq = ("tenant_id", "company_number") not in comp_uqs and ("company_number", "tenant_id") not in comp_uqs
-        if need_uq and _has_column(conn, "companies", "tenant_id") and _has_column(conn, "companies", "company_number"):
-            try:
-                op.create_unique_constraint(
-                    "uq_companies_tenant_company_number",
+            if has_column(cat, "companies", "company_number"):
+                op.create_index(
+                    "ix_companies_company_number",
                     "companies",
-                    ["tenant_id", "company_number"],
+                    ["company_number"],
+                    if_not_exists=True,
+                    postgresql_concurrently=True,
                 )
-            except Exception:
-                pass
 
-    # 3) source_events (create if missing, only if deps exist)
-    if _has_table(conn, "tenants") and _has_table(conn, "companies") and not _has_table(conn, "source_events"):
+        need_uq = frozenset(("tenant_id", "company_number")) not in comp_uqs
+        if need_uq and has_column(cat, "companies", "tenant_id") and has_column(cat, "companies", "company_number"):
+            # Build the unique index without blocking writes, then attach it as
+            # the constraint, which is a catalog-only swap.
+            try:
+                with op.get_context().autocommit_block():
+                    drop_invalid_indexes(cat, "companies", ("uq_companies_tenant_company_number",))
+                    op.create_index(
+                        "uq_companies_tenant_company_number",
+                        "companies",
+                        ["tenant_id", "company_number"],
+                        unique=True,
+                        if_not_exists=True,
+                        postgresql_concurrently=True,
+                    )
+            except IntegrityError as e:
+                # Existing duplicate (tenant_id, company_number) rows; the
+                # failed concurrent build leaves an INVALID index behind.
+                log.warning("Not enforcing uq_companies_tenant_company_number: %s", e.orig)
+                op.drop_index("uq_companies_tenant_company_number", table_name="companies", if_exists=True)
+            else:
+                # SAVEPOINT: a failed statement would otherwise abort the rest
+                # of this migration's transaction.
+                try:
+                    with conn.begin_nested():
+                        op.execute(
+                            "ALTER TABLE companies ADD CONSTRAINT uq_companies_tenant_company_number "
+                            "UNIQUE USING INDEX uq_companies_tenant_company_number"
+                        )
+                except DBAPIError as e:
+                    log.warning("Could not attach uq_companies_tenant_company_number as a constraint: %s", e.orig)
+
+    # 3) source_events (create if missing, only if companies exists too)
+    if has_table(cat, "companies") and not has_table(cat, "source_events"):
         op.create_table(
             "source_events",
             sa.Column("id", sa.Integer, primary_key=True),
@@ -141,17 +150,9 @@ def upgrade():
             sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=False),
         )
 
-        se_idx = _index_names(conn, "source_events")
-        if "ix_source_events_tenant_id" not in se_idx:
-            try:
-                op.create_index("ix_source_events_tenant_id", "source_events", ["tenant_id"])
-            except Exception:
-                pass
-        if "ix_source_events_company_id" not in se_idx:
-            try:
-                op.create_index("ix_source_events_company_id", "source_events", ["company_id"])
-            except Exception:
-                pass
+        # Freshly created above, so neither index can exist yet: no need to probe.
+        op.create_index("ix_source_events_tenant_id", "source_events", ["tenant_id"])
+        op.create_index("ix_source_events_company_id", "source_events", ["company_id"])
 
 
 def downgrade():
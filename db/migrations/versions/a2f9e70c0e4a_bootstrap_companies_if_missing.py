@@ -24,10 +24,12 @@ depends_on = None  # pragma: allowlist secret
 def upgrade() -> None:
     conn = op.get_bind()
 
-    # 1) Create table if it somehow doesn't exist yet.
+    # All idempotency lives in the SQL itself, so the whole bootstrap is sent
+    # as one multi-statement string: one round trip instead of three.
     conn.execute(
         sa.text(
             """
+        -- 1) Create table if it somehow doesn't exist yet.
         DO $$
         BEGIN
           IF NOT EXISTS (
@@ -45,37 +47,15 @@ def upgrade() -> None:
             CREATE INDEX IF NOT EXISTS ix_companies_name ON public.companies (name);
           END IF;
         END $$;
-        """
-        )
-    )
 
-    # 2) Ensure the unique index on name exists, but ONLY if the table exists.
-    conn.execute(
-        sa.text(
-            """
-        DO $$
-        BEGIN
-          IF EXISTS (
-            SELECT 1
-            FROM information_schema.tables
-            WHERE table_schema = 'public' AND table_name = 'companies'
-          ) THEN
-            -- Safe: IF NOT EXISTS avoids duplicate-index errors across re-runs.
-            CREATE UNIQUE INDEX IF NOT EXISTS ux_companies_name
-            ON public.companies (name);
-          ELSE
-            RAISE NOTICE 'companies table missing; skipping unique index creation';
-          END IF;
-        END $$;
-        """
-        )
-    )
+        -- 2) Ensure the unique index on name exists. The table is guaranteed
+        --    by step 1; IF NOT EXISTS avoids duplicate-index errors on re-runs.
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_companies_name
+        ON public.companies (name);
 
-    # 3) (Optional) Seed a couple of rows if the table is empty.
-    #    This keeps behavior aligned with "bootstrap" intent but is still idempotent.
-    conn.execute(
-        sa.text(
-            """
+        -- 3) (Optional) Seed a couple of rows if the table is empty.
+        --    This keeps behavior aligned with "bootstrap" intent but is still
+        --    idempotent.
         INSERT INTO public.companies (name, website)
         SELECT v.name, v.website
         FROM (VALUES
@@ -11,6 +11,11 @@ from typing import Sequence, Union
 from alembic import op
 import sqlalchemy as sa
 
+from db.migrations._reflect import (
+    catalog_snapshot,
+    check_constraints,
+    drop_invalid_indexes,
+)
 
 # revision identifiers, used by Alembic.
 revision: str = "e1f2a3b4c5d6"  # pragma: allowlist secret
@@ -20,153 +25,156 @@ down_revision: Union[str, Sequence[str], None] = (
 branch_labels: Union[str, Sequence[str], None] = None
 depends_on: Union[str, Sequence[str], None] = None  # pragma: allowlist secret
 
+# Check constraints for data validation, by name
+_CHECKS = {
+    "ck_companies_employee_count_positive": (
+        "employee_count IS NULL OR employee_count >= 0"
+    ),
+    "ck_companies_annual_revenue_positive": (
+        "annual_revenue IS NULL OR annual_revenue >= 0"
+    ),
+    "ck_companies_supported_countries": (
+        "country IN ('GB', 'IE', 'US', 'CA', 'AU', 'NZ')"
+    ),
+    "ck_companies_valid_data_source": (
+        "data_source IN ('manual', 'companies_house', 'scraped', 'api', 'import')"
+    ),
+}
+
+_INDEX_COLUMNS = (
+    "companies_house_number",
+    "postcode",
+    "country",
+    "industry",
+    "is_prospect",
+    "data_source",
+)
+
 
 def upgrade() -> None:
     """Add comprehensive fields to companies table."""
 
-    # Add new columns to existing companies table
-    # Companies House information
-    op.add_column(
-        "companies",
-        sa.Column("companies_house_number", sa.String(length=20), nullable=True),
-    )
-    op.add_column(
-        "companies",
-        sa.Column("companies_house_status", sa.String(length=50), nullable=True),
-    )
-
-    # Contact information
-    op.add_column("companies", sa.Column("email", sa.String(length=255), nullable=True))
-    op.add_column("companies", sa.Column("phone", sa.String(length=50), nullable=True))
-
-    # Address information
-    op.add_column("companies", sa.Column("address_line1", sa.Text(), nullable=True))
-    op.add_column("companies", sa.Column("address_line2", sa.Text(), nullable=True))
-    op.add_column("companies", sa.Column("city", sa.String(length=100), nullable=True))
-    op.add_column(
-        "companies", sa.Column("county", sa.String(length=100), nullable=True)
-    )
-    op.add_column(
-        "companies", sa.Column("postcode", sa.String(length=20), nullable=True)
-    )
-    op.add_column(
-        "companies",
-        sa.Column("country", sa.String(length=10), nullable=False, server_default="GB"),
-    )
-
-    # Business classification
-    op.add_column(
-        "companies", sa.Column("industry", sa.String(length=100), nullable=True)
-    )
-    op.add_column(
-        "companies", sa.Column("sic_code", sa.String(length=10), nullable=True)
-    )
-    op.add_column("companies", sa.Column("employee_count", sa.Integer(), nullable=True))
-    op.add_column("companies", sa.Column("annual_revenue", sa.Integer(), nullable=True))
-
-    # Data source tracking
-    op.add_column(
-        "companies",
-        sa.Column(
-            "data_source", sa.String(length=50), nullable=False, server_default="manual"
-        ),
-    )
-    op.add_column(
-        "companies",
-        sa.Column(
-            "last_updated_from_source", sa.DateTime(timezone=True), nullable=True
-        ),
-    )
-
-    # Sales intelligence metadata
-    op.add_column(
-        "companies",
-        sa.Column("is_prospect", sa.Boolean(), nullable=False, server_default="false"),
-    )
-    op.add_column(
-        "companies", sa.Column("prospect_stage", sa.String(length=50), nullable=True)
-    )
-    op.add_column("companies", sa.Column("notes", sa.Text(), nullable=True))
-
-    # Add updated_at timestamp field
-    op.add_column(
-        "companies", sa.Column("updated_at", sa.DateTime(timezone=True), nullable=True)
-    )
-
-    # Create additional indexes
-    op.create_index(
-        "ix_companies_companies_house_number",
-        "companies",
-        ["companies_house_number"],
-        unique=True,
-    )
-    op.create_index("ix_companies_postcode", "companies", ["postcode"])
-    op.create_index("ix_companies_country", "companies", ["country"])
-    op.create_index("ix_companies_industry", "companies", ["industry"])
-    op.create_index("ix_companies_is_prospect", "companies", ["is_prospect"])
-    op.create_index("ix_companies_data_source", "companies", ["data_source"])
-
-    # Add check constraints for data validation
-    op.create_check_constraint(
-        "ck_companies_employee_count_positive",
-        "companies",
-        "employee_count IS NULL OR employee_count >= 0",
-    )
-
-    op.create_check_constraint(
-        "ck_companies_annual_revenue_positive",
-        "companies",
-        "annual_revenue IS NULL OR annual_revenue >= 0",
-    )
-
-    op.create_check_constraint(
-        "ck_companies_supported_countries",
-        "companies",
-        "country IN ('GB', 'IE', 'US', 'CA', 'AU', 'NZ')",
-    )
-
-    op.create_check_constraint(
-        "ck_companies_valid_data_source",
-        "companies",
-        "data_source IN ('manual', 'companies_house', 'scraped', 'api', 'import')",
-    )
+    # DDL runs in phases: columns (with the CHECKs as NOT VALID), then
+    # indexes, then validation. No backfill is needed, since the new columns
+    # are NULL or take constant defaults, so the index builds and the
+    # validation scans both see the final data.
+    #
+    # The index builds commit phase 1 before alembic_version moves, so an
+    # interrupted run must be safe to repeat: every step skips what is
+    # already there and INVALID leftovers of a failed build are rebuilt.
+    cat = catalog_snapshot(op.get_bind(), ("companies",))
+
+    # 1. Add new columns to existing companies table in a single ALTER TABLE,
+    # so the catalog is updated under one lock acquisition rather than 21.
+    # Constant defaults take Postgres' fast-default path (no table rewrite).
+    alter = """
+        ALTER TABLE companies
+            -- Companies House information
+            ADD COLUMN IF NOT EXISTS companies_house_number VARCHAR(20),
+            ADD COLUMN IF NOT EXISTS companies_house_status VARCHAR(50),
+            -- Contact information
+            ADD COLUMN IF NOT EXISTS email VARCHAR(255),
+            ADD COLUMN IF NOT EXISTS phone VARCHAR(50),
+            -- Address information
+            ADD COLUMN IF NOT EXISTS address_line1 TEXT,
+            ADD COLUMN IF NOT EXISTS address_line2 TEXT,
+            ADD COLUMN IF NOT EXISTS city VARCHAR(100),
+            ADD COLUMN IF NOT EXISTS county VARCHAR(100),
+            ADD COLUMN IF NOT EXISTS postcode VARCHAR(20),
+            ADD COLUMN IF NOT EXISTS country VARCHAR(10) NOT NULL DEFAULT 'GB',
+            -- Business classification
+            ADD COLUMN IF NOT EXISTS industry VARCHAR(100),
+            ADD COLUMN IF NOT EXISTS sic_code VARCHAR(10),
+            ADD COLUMN IF NOT EXISTS employee_count INTEGER,
+            ADD COLUMN IF NOT EXISTS annual_revenue INTEGER,
+            -- Data source tracking
+            ADD COLUMN IF NOT EXISTS data_source VARCHAR(50) NOT NULL DEFAULT 'manual',
+            ADD COLUMN IF NOT EXISTS last_updated_from_source TIMESTAMP WITH TIME ZONE,
+            -- Sales intelligence metadata
+            ADD COLUMN IF NOT EXISTS is_prospect BOOLEAN NOT NULL DEFAULT false,
+            ADD COLUMN IF NOT EXISTS prospect_stage VARCHAR(50),
+            ADD COLUMN IF NOT EXISTS notes TEXT,
+            -- updated_at timestamp field
+            ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE
+    """
+    # Checks are added NOT VALID (validated below); Postgres has no
+    # ADD CONSTRAINT IF NOT EXISTS, so skip the ones already present.
+    existing_checks = check_constraints(cat, "companies")
+    for name, expr in _CHECKS.items():
+        if name not in existing_checks:
+            alter += f",\n            ADD CONSTRAINT {name} CHECK ({expr}) NOT VALID"
+    op.execute(sa.text(alter))
+
+    # Phases 2 and 3 run outside a transaction block, as CONCURRENTLY
+    # requires. autocommit_block() commits the column changes above first.
+    with op.get_context().autocommit_block():
+        # 2. Create additional indexes. CONCURRENTLY keeps companies writable
+        # while they build.
+        drop_invalid_indexes(
+            cat, "companies", [f"ix_companies_{column}" for column in _INDEX_COLUMNS]
+        )
+        for column in _INDEX_COLUMNS:
+            op.create_index(
+                f"ix_companies_{column}",
+                "companies",
+                [column],
+                unique=column == "companies_house_number",
+                if_not_exists=True,
+                postgresql_concurrently=True,
+            )
+
+        # 3. Validate the NOT VALID checks (a no-op for already valid ones).
+        # This scans companies under SHARE UPDATE EXCLUSIVE, which leaves
+        # reads and writes unblocked, instead of under the ALTER TABLE's
+        # exclusive lock.
+        for name in _CHECKS:
+            op.execute(sa.text(f"ALTER TABLE companies VALIDATE CONSTRAINT {name}"))
 
 
 def downgrade() -> None:
     """Remove enhanced fields from companies table."""
 
-    # Drop check constraints
-    op.drop_constraint("ck_companies_valid_data_source", "companies")
-    op.drop_constraint("ck_companies_supported_countries", "companies")
-    op.drop_constraint("ck_companies_annual_revenue_positive", "companies")
-    op.drop_constraint("ck_companies_employee_count_positive", "companies")
-
-    # Drop indexes
-    op.drop_index("ix_companies_data_source", table_name="companies")
-    op.drop_index("ix_companies_is_prospect", table_name="companies")
-    op.drop_index("ix_companies_industry", table_name="companies")
-    op.drop_index("ix_companies_country", table_name="companies")
-    op.drop_index("ix_companies_postcode", table_name="companies")
-    op.drop_index("ix_companies_companies_house_number", table_name="companies")
-
-    # Drop columns (in reverse order of addition)
-    op.drop_column("companies", "updated_at")
-    op.drop_column("companies", "notes")
-    op.drop_column("companies", "prospect_stage")
-    op.drop_column("companies", "is_prospect")
-    op.drop_column("companies", "last_updated_from_source")
-    op.drop_column("companies", "data_source")
-    op.drop_column("companies", "annual_revenue")
-    op.drop_column("companies", "employee_count")
-    op.drop_column("companies", "sic_code")
-    op.drop_column("companies", "industry")
-    op.drop_column("companies", "country")
-    op.drop_column("companies", "postcode")
-    op.drop_column("companies", "county")
-    op.drop_column("companies", "city")
-    op.drop_column("companies", "address_line2")
-    op.drop_column("companies", "address_line1")
-    op.drop_column("companies", "phone")
-    op.drop_column("companies", "email")
-    op.drop_column("companies", "companies_house_status")
-    op.drop_column("companies", "companies_house_number")
+    # Drop indexes. Like upgrade(), this commits before the ALTER below, so
+    # each step tolerates a previous partial run.
+    with op.get_context().autocommit_block():
+        for column in reversed(_INDEX_COLUMNS):
+            op.drop_index(
+                f"ix_companies_{column}",
+                table_name="companies",
+                if_exists=True,
+                postgresql_concurrently=True,
+            )
+
+    # Drop check constraints and columns (in reverse order of addition) in a
+    # single ALTER TABLE: one lock acquisition and catalog update.
+    op.execute(
+        sa.text(
+            """
+        ALTER TABLE companies
+            DROP CONSTRAINT IF EXISTS ck_companies_valid_data_source,
+            DROP CONSTRAINT IF EXISTS ck_companies_supported_countries,
+            DROP CONSTRAINT IF EXISTS ck_companies_annual_revenue_positive,
+            DROP CONSTRAINT IF EXISTS ck_companies_employee_count_positive,
+            DROP COLUMN IF EXISTS updated_at,
+            DROP COLUMN IF EXISTS notes,
+            DROP COLUMN IF EXISTS prospect_stage,
+            DROP COLUMN IF EXISTS is_prospect,
+            DROP COLUMN IF EXISTS last_updated_from_source,
+            DROP COLUMN IF EXISTS data_source,
+            DROP COLUMN IF EXISTS annual_revenue,
+            DROP COLUMN IF EXISTS employee_count,
+            DROP COLUMN IF EXISTS sic_code,
+            DROP COLUMN IF EXISTS industry,
+            DROP COLUMN IF EXISTS country,
+            DROP COLUMN IF EXISTS postcode,
+            DROP COLUMN IF EXISTS county,
+            DROP COLUMN IF EXISTS city,
+            DROP COLUMN IF EXISTS address_line2,
+            DROP COLUMN IF EXISTS address_line1,
+            DROP COLUMN IF EXISTS phone,
+            DROP COLUMN IF EXISTS email,
+            DROP COLUMN IF EXISTS companies_house_status,
+            DROP COLUMN IF EXISTS companies_house_number
+    """
+        )
+    )
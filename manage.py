@@ -16,9 +16,20 @@ def _run(cmd: list[str]) -> int:
     print("→", " ".join(cmd))
     return subprocess.call(cmd, cwd=str(REPO_ROOT), env=os.environ.copy())
 
+def _exec(cmd: list[str]) -> int:
+    # Terminal action: replace this process instead of fork + wait. Windows
+    # has no real exec (os.execv spawns and exits early), so it keeps _run.
+    if os.name == "nt":
+        return _run(cmd)
+    print("→", " ".join(cmd))
+    sys.stdout.flush()
+    os.chdir(REPO_ROOT)
+    os.execv(cmd[0], cmd)  # nosec B606 - fixed argv: sys.executable -m alembic
+    raise AssertionError("unreachable: os.execv does not return")
+
 def _alembic(*args: str) -> int:
     # Delegates to "python -m alembic ..." so it works in venv/CI
-    return _run([sys.executable, "-m", "alembic", *args])
+    return _exec([sys.executable, "-m", "alembic", *args])
 
 def cmd_db_current() -> int:
     return _alembic("current")
@@ -31,18 +42,31 @@ def cmd_db_downgrade_one() -> int:
 
 def cmd_check_db() -> int:
     # Non-fatal connectivity probe (mirrors test expectations)
+    from urllib.parse import quote_plus
+
     from sqlalchemy import create_engine, text  # type: ignore
+    from sqlalchemy.pool import NullPool  # type: ignore
+
+    from app.db_url import mask_dsn
 
     u = os.getenv("POSTGRES_USER", "postgres")
     p = os.getenv("POSTGRES_PASSWORD", "")
     h = os.getenv("POSTGRES_HOST", "127.0.0.1")
     port = os.getenv("POSTGRES_PORT", "5432")
     db = os.getenv("POSTGRES_DB", "detecktiv")
-    url = f"postgresql+psycopg2://{u}:{p}@{h}:{port}/{db}?sslmode=disable"
-    safe_url = url.replace(p, "***") if p else url
-    print("SQLAlchemy URL:", safe_url)
+    # Quote user/password so characters like '@' or ':' can't split the URL
+    url = f"postgresql+psycopg2://{quote_plus(u)}:{quote_plus(p)}@{h}:{port}/{db}?sslmode=disable"
+    print("SQLAlchemy URL:", mask_dsn(url))
 
-    eng = create_engine(url, future=True)
+    # manage.py is one-shot, so there is no pool worth keeping. Fail fast on an
+    # unreachable host and skip BEGIN/ROLLBACK around the probe.
+    eng = create_engine(
+        url,
+        future=True,
+        poolclass=NullPool,
+        isolation_level="AUTOCOMMIT",
+        connect_args={"connect_timeout": 3, "application_name": "manage.check-db"},
+    )
     with eng.connect() as c:
         print("select 1 ->", c.execute(text("select 1")).scalar_one())
     return 0
@@ -44,6 +44,14 @@ def main():
             print("\n[Default tenant]")
             print("tenants table is missing")
 
+        # Reflect indexes for every table we report on in one catalog pass
+        # rather than one get_indexes() round trip per table.
+        reported = [t for t in ("companies", "source_events") if t in tables]
+        indexes = {}
+        if reported:
+            for (_, t), ixs in insp.get_multi_indexes(filter_names=reported).items():
+                indexes[t] = ixs
+
         if "companies" in tables:
             cols = insp.get_columns("companies")
             col_map = {c["name"]: c for c in cols}
@@ -59,7 +67,7 @@ def main():
                 print(" -", fk.get("name"), "->", fk.get("referred_table"), fk.get("constrained_columns"))
 
             print("\n[companies indexes]")
-            for ix in insp.get_indexes("companies"):
+            for ix in indexes["companies"]:
                 print(" -", ix["name"], ix["column_names"])
 
             print("\n[companies unique constraints]")
@@ -68,7 +76,7 @@ def main():
 
         if "source_events" in tables:
             print("\n[source_events indexes]")
-            for ix in insp.get_indexes("source_events"):
+            for ix in indexes["source_events"]:
                 print(" -", ix["name"], ix["column_names"])
 
     print("\n[OK] verification done")
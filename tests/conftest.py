@@ -79,7 +79,14 @@ def event_loop():
     loop.close()
 
 
-@pytest.fixture(scope="session", autouse=True)
+@pytest.fixture(autouse=True)
+def _require_test_database(request):
+    """Set up the test database for every test not marked ``no_db``."""
+    if request.node.get_closest_marker("no_db") is None:
+        request.getfixturevalue("setup_test_database")
+
+
+@pytest.fixture(scope="session")
 def setup_test_database():
     """Set up test database and run migrations."""
     # Skip if database tests are not enabled
@@ -375,6 +382,9 @@ def pytest_configure(config):
     config.addinivalue_line("markers", "integration: marks tests as integration tests")
     config.addinivalue_line("markers", "unit: marks tests as unit tests")
     config.addinivalue_line("markers", "api: marks tests as API tests")
+    config.addinivalue_line(
+        "markers", "no_db: test never touches the database (runs without RUN_DB_TESTS)"
+    )
 
 
 def pytest_collection_modifyitems(config, items):
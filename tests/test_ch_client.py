@@ -0,0 +1,68 @@
+# tests/test_ch_client.py
+from __future__ import annotations
+
+import asyncio
+import base64
+
+import httpx
+import pytest
+
+from app.services import ch_client
+from app.services.ch_client import CompaniesHouseClient
+
+
+pytestmark = pytest.mark.no_db
+
+
+def _mock_async_client(monkeypatch, handler):
+    # Route the client's own httpx.AsyncClient through a MockTransport, keeping
+    # the headers/limits it is constructed with
+    real_async_client = httpx.AsyncClient
+
+    def factory(**kwargs):
+        return real_async_client(transport=httpx.MockTransport(handler), **kwargs)
+
+    monkeypatch.setattr(ch_client.httpx, "AsyncClient", factory)
+
+
+def test_auth_header_sent_without_per_call_headers(monkeypatch):
+    seen: list[httpx.Request] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        seen.append(request)
+        return httpx.Response(200, json={"company_number": "00000006"})
+
+    _mock_async_client(monkeypatch, handler)
+
+    async def run():
+        async with CompaniesHouseClient(api_key="test-key") as client:
+            await client.company_profile("00000006")
+            await client.officers("00000006")
+
+    asyncio.run(run())
+
+    expected = "Basic " + base64.b64encode(b"test-key:").decode()
+    assert len(seen) == 2
+    for request in seen:
+        assert request.headers["Authorization"] == expected
+        assert request.headers["Accept"] == "application/json"
+
+
+def test_no_auth_header_without_api_key(monkeypatch):
+    monkeypatch.delenv("CH_API_KEY", raising=False)
+    seen: list[httpx.Request] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        seen.append(request)
+        return httpx.Response(200, json={})
+
+    _mock_async_client(monkeypatch, handler)
+
+    async def run():
+        async with CompaniesHouseClient() as client:
+            await client.psc("00000006")
+
+    asyncio.run(run())
+
+    assert len(seen) == 1
+    assert "Authorization" not in seen[0].headers